@@ -0,0 +1,156 @@
+'''Pooled, retrying, rate-controlled HTTP session for ArchivesSnake clients.
+
+configure_client swaps a client's requests.Session for an AspaceSession, so every call made through
+the client (aspace.client.get/post, and JSONModel lookups) gets connection pooling, retry with jittered
+backoff on 5xx and connection errors, and optional adaptive concurrency control.  4xx responses are
+validation or permission errors, and are returned immediately.
+
+POSTs aren't idempotent, so they're only retried when the connection couldn't be made or the server
+answered 503 (unavailable, so didn't act); other errors are returned or raised rather than risk a duplicate.'''
+
+import random
+import threading
+
+from time import monotonic, sleep
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from asnake.logging import get_logger
+
+# Methods for which a request that may have reached the server is safe to repeat
+idempotent_methods = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+def never_sent(error):
+    '''Whether a requests exception means the request failed while connecting, before the server could act on it'''
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+class AdaptiveLimiter:
+    '''Concurrency limiter that backs off when the server slows down.
+
+Additive increase, multiplicative decrease: the permitted number of in-flight requests grows by about one
+per round of successful requests, and shrinks by a quarter whenever smoothed latency rises past
+`tolerance` times the best latency seen, or the server returns an error.  max_rate, if set, also spaces
+requests to at most that many per second.'''
+    def __init__(self, max_concurrency, min_concurrency=1, tolerance=2.0, max_rate=None):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.tolerance = tolerance
+        self.interval = 1.0 / max_rate if max_rate else 0
+        self.next_start = 0
+        self.in_flight = 0
+        self.ewma = None
+        self.best = None
+        self.last_decrease = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            now = monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+    def release(self, latency, overloaded=False):
+        with self.cond:
+            self.in_flight -= 1
+            if latency is not None:
+                self.ewma = latency if self.ewma is None else 0.8 * self.ewma + 0.2 * latency
+                self.best = latency if self.best is None else min(self.best, latency)
+            now = monotonic()
+            slow = self.ewma is not None and self.ewma > self.best * self.tolerance
+            if overloaded or slow:
+                # Only back off once per smoothed round trip, so one slow burst doesn't collapse the limit
+                if now - self.last_decrease > (self.ewma or 0):
+                    self.limit = max(self.min_concurrency, self.limit * 0.75)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+class AspaceSession(requests.Session):
+    '''requests.Session with pooled connections, retries and optional rate control'''
+    def __init__(self, retries=5, backoff=0.5, max_backoff=30, pool_size=10, limiter=None):
+        super().__init__()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        method = method.upper()
+        first_start = monotonic()
+        for attempt in range(self.retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            start = monotonic()
+            res = error = None
+            try:
+                res = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                if self.limiter:
+                    overloaded = error is not None or (res is not None and res.status_code >= 500)
+                    self.limiter.release(monotonic() - start if res is not None else None, overloaded)
+
+            # Anything else may have reached the server, and repeating a POST could create a record twice
+            if error is not None:
+                retryable = method in idempotent_methods or never_sent(error)
+                if not retryable or attempt == self.retries:
+                    raise error
+                get_logger('aspace_session').warning('retry_request', method=method, url=url, attempt=attempt + 1, error=str(error))
+            elif (res.status_code == 503 or res.status_code >= 500 and method in idempotent_methods) and attempt < self.retries:
+                get_logger('aspace_session').warning('retry_request', method=method, url=url, attempt=attempt + 1, status=res.status_code)
+            else:
+                # Wall time across all attempts and backoff, for telemetry
+                res.total_elapsed = monotonic() - first_start
+                res.attempts = attempt + 1
+                return res
+
+            # Full jitter exponential backoff
+            sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+def add_client_arguments(ap):
+    '''Add CLI options controlling retries and rate to an ArgumentParser'''
+    ap.add_argument('--retries',
+                    type=int,
+                    default=5,
+                    help='Times to retry API requests that fail with a 5xx or connection error (POSTs: only a 503 or failed connection)')
+    ap.add_argument('--backoff',
+                    type=float,
+                    default=0.5,
+                    help='Base seconds of (jittered, exponential) backoff between retries')
+    ap.add_argument('--max_rate',
+                    type=float,
+                    default=None,
+                    help='Maximum API requests per second')
+    ap.add_argument('--adaptive',
+                    action='store_true',
+                    help='Reduce the number of concurrent requests when server latency rises')
+
+def configure_client(client, args, concurrency=1):
+    '''Replace client's session with an AspaceSession configured from add_client_arguments options.
+
+concurrency is the most requests the calling script will have in flight at once.'''
+    limiter = None
+    if args.adaptive or args.max_rate:
+        # Without --adaptive, the limit is pinned at concurrency and only max_rate applies
+        limiter = AdaptiveLimiter(concurrency, min_concurrency=1 if args.adaptive else concurrency,
+                                  max_rate=args.max_rate)
+    session = AspaceSession(retries=args.retries, backoff=args.backoff,
+                            pool_size=max(10, concurrency), limiter=limiter)
+    session.headers.update(client.session.headers)
+    client.session = session
+    return client
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+'''End-to-end throughput benchmark against mock_aspace.py.
+
+Generates synthetic workbooks of N rows, runs import_container_data.py and the fixup scripts against
+an in-process mock ArchivesSpace, and reports rows/sec, requests/sec and peak RSS for each.'''
+
+import json
+import os
+import subprocess
+import sys
+
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import openpyxl
+import yaml
+
+from mock_aspace import MockASpace
+
+here = dirname(abspath(__file__))
+
+ap = ArgumentParser(description='Benchmark container scripts against a mock ArchivesSpace')
+ap.add_argument('--rows',
+                type=int,
+                default=1000,
+                help='Number of sub_container (archival object) rows to generate')
+ap.add_argument('--rows_per_container',
+                type=int,
+                default=4,
+                help='Number of sub_container rows pointing to each top container')
+ap.add_argument('--latency',
+                type=float,
+                default=0.005,
+                help='Seconds of delay added to every mock request')
+ap.add_argument('--error_rate',
+                type=float,
+                default=0.0,
+                help='Fraction of mock requests that fail with a 500')
+ap.add_argument('--script_args',
+                default='',
+                help='Extra arguments passed to every script, e.g. "--concurrency 8"')
+ap.add_argument('--output',
+                help='Write results as JSON to this file')
+ap.add_argument('--baseline',
+                help='JSON results of an earlier run to compare against')
+ap.add_argument('--tolerance',
+                type=float,
+                default=0.2,
+                help='Fractional drop in rows/sec versus baseline reported as a regression')
+
+def write_workbook(filename, sheets):
+    '''Write {title: [header, *rows]} to an xlsx file'''
+    wb = openpyxl.Workbook(write_only=True)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    wb.save(filename)
+
+def import_rows(n_rows, rows_per_container):
+    n_containers = max(1, n_rows // rows_per_container)
+    ao_rows = [['Object Record ID', 'Instance Type', 'TempContainerRecord', 'Child Container Type', 'Child Container Indicator']]
+    ao_rows.extend([1000 + i, 'mixed_materials', f'T{i % n_containers}', 'folder', str(i)] for i in range(n_rows))
+    container_rows = [['TempContainerRecord', 'Container Profile', 'Container Type', 'Container Indicator',
+                       'Barcode', 'Location', 'Location Start Date']]
+    container_rows.extend([f'T{i}', None, 'box', str(i), f'BC{i:08d}', None, None] for i in range(n_containers))
+    return {'sub_containers': ao_rows, 'containers': container_rows}, n_containers
+
+def run_script(name, argv, config_file):
+    '''Run a script as a subprocess, returns (seconds, peak RSS in bytes, exit status)'''
+    env = dict(os.environ, ASNAKE_CONFIG_FILE=config_file)
+    start = perf_counter()
+    proc = subprocess.Popen([sys.executable, join(here, name), *argv], env=env, cwd=here,
+                            stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return elapsed, rusage.ru_maxrss * 1024, proc.returncode
+
+def count_events(logfile):
+    counts = {}
+    with open(logfile) as f:
+        for line in f:
+            event = json.loads(line)['event']
+            counts[event] = counts.get(event, 0) + 1
+    return counts
+
+if __name__ == '__main__':
+    args = ap.parse_args()
+    extra = args.script_args.split()
+    mock = MockASpace(latency=args.latency, error_rate=args.error_rate, seed=0).start()
+    results = []
+
+    with TemporaryDirectory() as tmp:
+        config_file = join(tmp, 'archivessnake.yml')
+        with open(config_file, 'w') as f:
+            yaml.safe_dump({'baseurl': mock.baseurl, 'username': 'admin', 'password': 'admin'}, f)
+
+        def bench(name, workbook, n_rows, argv):
+            logfile = join(tmp, name.replace('.py', '.log'))
+            before = sum(mock.requests.values())
+            elapsed, rss, status = run_script(name, [workbook, '--logfile', logfile, *argv, *extra], config_file)
+            n_requests = sum(mock.requests.values()) - before
+            results.append({'script': name, 'rows': n_rows, 'seconds': round(elapsed, 3),
+                            'rows_per_sec': round(n_rows / elapsed, 1),
+                            'requests': n_requests, 'requests_per_sec': round(n_requests / elapsed, 1),
+                            'peak_rss_mb': round(rss / 2**20, 1), 'exit_status': status,
+                            'events': count_events(logfile) if status == 0 else {}})
+
+        sheets, n_containers = import_rows(args.rows, args.rows_per_container)
+        workbook = join(tmp, 'import.xlsx')
+        write_workbook(workbook, sheets)
+        bench('import_container_data.py', workbook, args.rows + n_containers, ['--repo_id', '2'])
+
+        container_ids = sorted(int(uri.split('/')[-1]) for uri in mock.top_containers)
+        countway = join(tmp, 'countway.xlsx')
+        write_workbook(countway, {'containers': [['Container Record ID', 'Barcode', 'Location', 'Location Start Date']] +
+                                  [[tc_id, f'NEW{tc_id:08d}', None, None] for tc_id in container_ids]})
+        bench('update_countway_containers.py', countway, len(container_ids), ['--repo_id', '2'])
+
+        linked = [(int(uri.split('/')[-1]), int(ao['instances'][0]['sub_container']['top_container']['ref'].split('/')[-1]))
+                  for uri, ao in mock.archival_objects.items() if ao['instances']]
+        fix_huh = join(tmp, 'fix_huh.xlsx')
+        write_workbook(fix_huh, {'aos': [['Archival Object', 'Current Container Record ID', 'New Container Record ID', 'Repo ID']] +
+                                 [[ao_id, tc_id, container_ids[(container_ids.index(tc_id) + 1) % len(container_ids)], 2]
+                                  for ao_id, tc_id in linked]})
+        bench('fix_huh_top_containers.py', fix_huh, len(linked), [])
+
+    mock.stop()
+
+    print(f"{'script':32} {'rows':>8} {'seconds':>9} {'rows/sec':>10} {'requests':>9} {'req/sec':>9} {'RSS MB':>8}")
+    for r in results:
+        print(f"{r['script']:32} {r['rows']:>8} {r['seconds']:>9} {r['rows_per_sec']:>10} "
+              f"{r['requests']:>9} {r['requests_per_sec']:>9} {r['peak_rss_mb']:>8}"
+              + ('' if r['exit_status'] == 0 else f"  (exited {r['exit_status']})"))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r['script']: r for r in json.load(f)}
+        regressions = [r for r in results if r['script'] in baseline and
+                       r['rows_per_sec'] < baseline[r['script']]['rows_per_sec'] * (1 - args.tolerance)]
+        for r in regressions:
+            print(f"REGRESSION {r['script']}: {r['rows_per_sec']} rows/sec vs {baseline[r['script']]['rows_per_sec']} baseline")
+        if regressions:
+            exit(1)
@@ -0,0 +1,75 @@
+'''Reading structlog JSON event logs written by the import and fixup scripts.'''
+
+import gzip
+import heapq
+import io
+import json
+
+from os.path import exists, expanduser, join
+
+class LogReader(io.TextIOWrapper):
+    '''Text stream of a logfile.
+
+truncated_errors are what reading raises at the end of a compressed log whose writer was killed
+before closing it, or that is still being written.'''
+    def __init__(self, raw, truncated_errors=(EOFError,)):
+        super().__init__(raw, encoding='utf8')
+        self.truncated_errors = truncated_errors
+
+def open_log(filename):
+    '''Open a logfile for reading as a LogReader, transparently decompressing gzip or zstd'''
+    filename = expanduser(filename)
+    with open(filename, 'rb') as f:
+        magic = f.read(4)
+    if magic[:2] == b'\x1f\x8b':
+        return LogReader(gzip.open(filename, 'rb'))
+    if magic == b'\x28\xb5\x2f\xfd':
+        import zstandard
+        # Each run appends its own frame
+        reader = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), read_across_frames=True)
+        return LogReader(reader, (EOFError, zstandard.ZstdError))
+    return LogReader(open(filename, 'rb'))
+
+def read_lines(f):
+    '''Yield lines of an open log, stopping quietly at a truncated compressed ending'''
+    try:
+        yield from f
+    except getattr(f, 'truncated_errors', (EOFError,)):
+        return
+
+def payload_dir(logfile):
+    '''Directory that large event fields of logfile are stored in, see logsink.py'''
+    return f'{expanduser(logfile)}.payloads'
+
+def resolve_payloads(event, logfile):
+    '''Replace {"payload": sha256} references in an event with the JSON stored for them'''
+    for key, value in event.items():
+        if isinstance(value, dict) and value.keys() == {'payload'}:
+            digest = value['payload']
+            with gzip.open(join(payload_dir(logfile), digest[:2], f'{digest}.json.gz'), 'rt', encoding='utf8') as f:
+                event[key] = json.load(f)
+    return event
+
+def iter_events(filenames, resolve=False):
+    '''Yield each event, in order, from one or more logfiles, with stored payloads restored if resolve is set'''
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    for filename in filenames:
+        with open_log(filename) as f:
+            for line in read_lines(f):
+                if line.strip():
+                    event = json.loads(line)
+                    yield resolve_payloads(event, filename) if resolve else event
+
+def merge_logs(filenames, out):
+    '''Write the events of several logfiles, each in time order, to out interleaved in time order.
+
+Logfiles that don't exist, e.g. of a worker that failed before logging anything, are skipped.'''
+    def lines(filename):
+        with open_log(filename) as f:
+            for line in read_lines(f):
+                if line.strip():
+                    yield json.loads(line).get('timestamp', ''), line if line.endswith('\n') else line + '\n'
+    filenames = [filename for filename in filenames if exists(expanduser(filename))]
+    for _, line in heapq.merge(*map(lines, filenames), key=lambda pair: pair[0]):
+        out.write(line)
@@ -0,0 +1,71 @@
+'''Memory-bounded grouping of spreadsheet rows by key.
+
+SortedGroups sorts in memory while the rows fit in its buffer, and otherwise falls back to an external
+merge sort: sorted runs of rows are spilled to temporary files and merged lazily while iterating, so
+memory stays bounded by the buffer however many rows there are.'''
+
+import heapq
+import pickle
+import tempfile
+
+from itertools import groupby, islice
+
+def spill(items, f):
+    '''Append items to an open binary file'''
+    for item in items:
+        pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+
+def unspill(f):
+    '''Yield items written to f by spill, from the start'''
+    f.seek(0)
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+class SortedGroups:
+    '''Iterable of (key, rows) pairs for rows grouped by key(row), in key order.
+
+Rows within a group keep their original order.  Consumes rows on creation; `rows` is the number read.'''
+    def __init__(self, rows, key, buffer_rows=200000):
+        if buffer_rows < 1:
+            raise ValueError(f'buffer_rows must be at least 1, not {buffer_rows}')
+        self.key = key
+        self.rows = 0
+        self.runs = []
+        self.buffer = None
+        rows = iter(rows)
+        while True:
+            buffer = sorted(islice(rows, buffer_rows), key=key)
+            self.rows += len(buffer)
+            if not self.runs and len(buffer) < buffer_rows:
+                self.buffer = buffer
+                return
+            if buffer:
+                run = tempfile.TemporaryFile()
+                spill(buffer, run)
+                self.runs.append(run)
+            if len(buffer) < buffer_rows:
+                return
+
+    def __iter__(self):
+        if self.buffer is not None:
+            rows = self.buffer
+        else:
+            # merge is stable, and runs are in sheet order, so ties keep sheet order
+            rows = heapq.merge(*(unspill(run) for run in self.runs), key=self.key)
+        for key, group in groupby(rows, key=self.key):
+            yield key, list(group)
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
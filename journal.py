@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+'''On-disk run journal for import_container_data.py.
+
+A SQLite file recording created containers (keyed by TempContainerRecord) and updated archival objects
+(keyed by id).  Each record is committed as it is written, so an interrupted run can be resumed by
+indexed lookups instead of replaying the whole log.
+
+It also keeps a fingerprint of the spreadsheet rows last applied to each container and archival object,
+with the rows themselves, so that a run against a revised spreadsheet (--incremental) can apply only
+what changed.'''
+
+import hashlib
+import json
+import sqlite3
+
+from argparse import ArgumentParser
+from collections.abc import MutableMapping, MutableSet
+from contextlib import contextmanager
+from os.path import expanduser
+
+from eventlog import iter_events
+
+schema = '''
+CREATE TABLE IF NOT EXISTS containers (temp_id TEXT PRIMARY KEY, id INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS aos (ao_id INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS container_rows (temp_id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, rows TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS ao_rows (ao_id INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL, rows TEXT NOT NULL);
+'''
+
+def row_fingerprint(rows):
+    '''Content hash of a spreadsheet row, or of a list of them'''
+    return hashlib.sha256(json.dumps(rows, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+class RunJournal:
+    '''SQLite journal of a (possibly multi-run) import.
+
+`containers` behaves like the temp_id2id dict, and `aos` like the ao_processed set.
+`container_rows` and `ao_rows` map each temp_id and ao_id to the rows last applied to it.'''
+    def __init__(self, filename):
+        self.conn = sqlite3.connect(expanduser(filename))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(schema)
+        self.in_batch = False
+        self.containers = JournalContainers(self)
+        self.aos = JournalAOs(self)
+        self.container_rows = JournalRows(self, 'container_rows', 'temp_id')
+        self.ao_rows = JournalRows(self, 'ao_rows', 'ao_id')
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def write(self, sql, params=()):
+        '''Execute a write, committing it immediately unless inside batch()'''
+        self.conn.execute(sql, params)
+        if not self.in_batch:
+            self.conn.commit()
+
+    @contextmanager
+    def batch(self):
+        '''Group writes into a single transaction, e.g. when loading from a logfile'''
+        self.in_batch = True
+        try:
+            with self.conn:
+                yield self
+        finally:
+            self.in_batch = False
+
+    def close(self):
+        self.conn.close()
+
+class JournalContainers(MutableMapping):
+    '''Mapping of temp_id -> top container id'''
+    def __init__(self, journal):
+        self.journal = journal
+
+    def __getitem__(self, temp_id):
+        row = self.journal.execute('SELECT id FROM containers WHERE temp_id = ?', (temp_id,)).fetchone()
+        if row is None:
+            raise KeyError(temp_id)
+        return row[0]
+
+    def __setitem__(self, temp_id, container_id):
+        self.journal.write('INSERT OR REPLACE INTO containers (temp_id, id) VALUES (?, ?)', (temp_id, container_id))
+
+    def __delitem__(self, temp_id):
+        self.journal.write('DELETE FROM containers WHERE temp_id = ?', (temp_id,))
+
+    def __iter__(self):
+        return (row[0] for row in self.journal.execute('SELECT temp_id FROM containers'))
+
+    def __len__(self):
+        return self.journal.execute('SELECT count(*) FROM containers').fetchone()[0]
+
+class JournalAOs(MutableSet):
+    '''Set of processed archival object ids'''
+    def __init__(self, journal):
+        self.journal = journal
+
+    def __contains__(self, ao_id):
+        return self.journal.execute('SELECT 1 FROM aos WHERE ao_id = ?', (ao_id,)).fetchone() is not None
+
+    def add(self, ao_id):
+        self.journal.write('INSERT OR IGNORE INTO aos (ao_id) VALUES (?)', (ao_id,))
+
+    def discard(self, ao_id):
+        self.journal.write('DELETE FROM aos WHERE ao_id = ?', (ao_id,))
+
+    def __iter__(self):
+        return (row[0] for row in self.journal.execute('SELECT ao_id FROM aos'))
+
+    def __len__(self):
+        return self.journal.execute('SELECT count(*) FROM aos').fetchone()[0]
+
+class JournalRows(MutableMapping):
+    '''Mapping of key -> rows last applied to a record, stored with their row_fingerprint'''
+    def __init__(self, journal, table, key):
+        self.journal = journal
+        self.table = table
+        self.key = key
+
+    def __getitem__(self, key):
+        row = self.journal.execute(f'SELECT rows FROM {self.table} WHERE {self.key} = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, rows):
+        self.journal.write(f'INSERT OR REPLACE INTO {self.table} ({self.key}, fingerprint, rows) VALUES (?, ?, ?)',
+                           (key, row_fingerprint(rows), json.dumps(rows, default=str)))
+
+    def __delitem__(self, key):
+        self.journal.write(f'DELETE FROM {self.table} WHERE {self.key} = ?', (key,))
+
+    def __contains__(self, key):
+        return self.journal.execute(f'SELECT 1 FROM {self.table} WHERE {self.key} = ?', (key,)).fetchone() is not None
+
+    def fingerprint(self, key):
+        '''Fingerprint of the rows stored for key, or None'''
+        row = self.journal.execute(f'SELECT fingerprint FROM {self.table} WHERE {self.key} = ?', (key,)).fetchone()
+        return row and row[0]
+
+    def __iter__(self):
+        return (row[0] for row in self.journal.execute(f'SELECT {self.key} FROM {self.table}'))
+
+    def __len__(self):
+        return self.journal.execute(f'SELECT count(*) FROM {self.table}').fetchone()[0]
+
+ap = ArgumentParser(description='Build an import journal from an existing import_container_data.py logfile')
+ap.add_argument('logfile',
+                help='Logfile of a previous import')
+ap.add_argument('journal',
+                help='Journal file to create or add to')
+
+if __name__ == '__main__':
+    from import_container_data import populate_skiplists
+
+    args = ap.parse_args()
+    journal = RunJournal(args.journal)
+    with journal.batch():
+        populate_skiplists(iter_events(args.logfile), journal.containers, journal.aos)
+    print(f"{len(journal.containers)} containers and {len(journal.aos)} archival objects journaled")
+    journal.close()
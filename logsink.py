@@ -0,0 +1,219 @@
+'''Compact event log output for the import and fixup scripts.
+
+setup_event_log sets up asnake logging like setup_logging, with three optional changes:
+  - compression: the logfile is written gzip or zstd compressed
+  - async: lines are written and compressed on a background thread, off the request path
+  - payload_threshold: bulky event fields (whole records and server responses on failures) whose JSON is longer
+    than this are stored once each in a content-addressed directory beside the log, LOGFILE.payloads, and the
+    event keeps only a {"payload": "<sha256>"} reference.  eventlog.resolve_payloads restores them.  Fields that
+    resuming reads (e.g. data, instances_added) always stay inline.  With async, payloads are written on the
+    background thread too.
+
+eventlog.open_log detects compression itself, so logs written this way are read like any other.'''
+
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import tempfile
+import zlib
+
+from logging.handlers import QueueHandler, QueueListener
+
+import structlog
+import asnake.logging
+from asnake.logging import setup_logging
+
+from eventlog import payload_dir
+
+def add_log_arguments(ap):
+    '''Add CLI options controlling log output to an ArgumentParser'''
+    ap.add_argument('--log_compression',
+                    choices=['gzip', 'zstd'],
+                    default=None,
+                    help='Compress the logfile (zstd requires the zstandard package)')
+    ap.add_argument('--async_log',
+                    action='store_true',
+                    help='Write the logfile from a background thread')
+    ap.add_argument('--payload_threshold',
+                    type=int,
+                    default=0,
+                    help='Store failed records and responses with JSON longer than this many bytes in LOGFILE.payloads, by hash (default: keep inline)')
+
+# Event fields holding whole records or server responses, which nothing reads back when resuming
+bulky_fields = ('ao', 'ao_json', 'result', 'response')
+
+class PayloadStore:
+    '''structlog processor moving large bulky_fields of events into content-addressed files'''
+    def __init__(self, directory, threshold):
+        self.directory = directory
+        self.threshold = threshold
+
+    def store(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, digest[:2], f'{digest}.json.gz')
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so concurrent writers (threads or shard processes) never expose a partial file
+            tmp = f'{path}.{os.getpid()}.{id(data)}.tmp'
+            with gzip.open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def __call__(self, logger, method_name, event_dict):
+        for key in bulky_fields:
+            value = event_dict.get(key)
+            if isinstance(value, (dict, list)):
+                data = json.dumps(value, default=str).encode('utf8')
+                if len(data) > self.threshold:
+                    event_dict[key] = {'payload': self.store(data)}
+        return event_dict
+
+class PayloadHandler(logging.Handler):
+    '''Log handler passing rendered events to handler with their large bulky_fields moved into a PayloadStore.
+
+Used for async logs in place of the PayloadStore processor, so payloads are written on the background thread.'''
+    def __init__(self, store, handler):
+        super().__init__()
+        self.store = store
+        self.handler = handler
+
+    def emit(self, record):
+        message = record.getMessage()
+        # Most events have no bulky fields, and needn't be parsed
+        if any(f'"{key}": ' in message for key in bulky_fields):
+            event = self.store(None, None, json.loads(message))
+            record.msg, record.args = json.dumps(event), None
+        self.handler.handle(record)
+
+    def flush(self):
+        self.handler.flush()
+
+def decompressor(compression):
+    '''Incremental decompressor for a single gzip member or zstd frame'''
+    if compression == 'gzip':
+        return zlib.decompressobj(wbits=31)
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj()
+
+def decompression_errors(compression):
+    if compression == 'gzip':
+        return (zlib.error,)
+    import zstandard
+    return (zstandard.ZstdError,)
+
+def last_member(filename, compression):
+    '''Returns (offset, complete) of the last gzip member or zstd frame in filename.
+
+Raises RuntimeError if an earlier member is damaged.'''
+    errors = decompression_errors(compression)
+    start = pos = 0
+    d = decompressor(compression)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            while chunk:
+                try:
+                    d.decompress(chunk)
+                except errors:
+                    raise RuntimeError(f"{filename} is damaged at byte {start}; log to a new file")
+                if d.eof:
+                    pos += len(chunk) - len(d.unused_data)
+                    start, chunk, d = pos, d.unused_data, decompressor(compression)
+                else:
+                    pos += len(chunk)
+                    chunk = b''
+    return start, start == pos
+
+def repair_log(filename, compression):
+    '''Cut an incomplete last member or frame, left by a run that was killed, off a compressed log,
+and append the complete lines it held as a new one, so that what later runs append stays readable'''
+    if not os.path.exists(filename) or not os.path.getsize(filename):
+        return
+    start, complete = last_member(filename, compression)
+    if complete:
+        return
+    d = decompressor(compression)
+    with tempfile.TemporaryFile() as salvaged:
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                salvaged.write(d.decompress(chunk))
+        with open(filename, 'r+b') as f:
+            f.truncate(start)
+        salvaged.seek(0)
+        with open_compressed(filename, compression, repair=False) as f:
+            for line in salvaged:
+                # The last line was cut off mid-write
+                if line.endswith(b'\n'):
+                    f.write(line.decode('utf8'))
+
+def open_compressed(filename, compression, repair=True):
+    '''Open filename for appending text, compressed with compression ('gzip' or 'zstd').
+
+Each run appends a new gzip member or zstd frame, which readers treat as one stream.
+Unless repair is False, an incomplete final member is repaired first (see repair_log).'''
+    if repair:
+        repair_log(filename, compression)
+    if compression == 'gzip':
+        return gzip.open(filename, 'at', encoding='utf8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError('--log_compression zstd requires the zstandard package')
+        return zstandard.open(filename, 'at', encoding='utf8')
+    raise ValueError(f"Unsupported compression: {compression}")
+
+def setup_event_log(filename, args, payloads_for=None):
+    '''Set up asnake logging to filename, with the options from add_log_arguments.
+
+payloads_for is the logfile whose payload directory large fields go to, by default filename itself;
+shard logs that are merged into a main log use the main log's.'''
+    filename = os.path.expanduser(filename)
+    stream = None
+    if args.log_compression:
+        stream = open_compressed(filename, args.log_compression)
+        setup_logging(stream=stream)
+    else:
+        setup_logging(filename=filename)
+
+    store = None
+    if args.payload_threshold:
+        store = PayloadStore(payload_dir(payloads_for or filename), args.payload_threshold)
+    if store and not args.async_log:
+        processors = structlog.get_config()['processors']
+        # Before the final JSONRenderer
+        structlog.configure(processors=processors[:-1] + [store, processors[-1]])
+
+    asnake_logger = logging.getLogger('asnake')
+    handler = asnake.logging.handler
+    listener = None
+    if args.async_log:
+        asnake_logger.removeHandler(handler)
+        queue_handler = QueueHandler(queue.SimpleQueue())
+        listener = QueueListener(queue_handler.queue, PayloadHandler(store, handler) if store else handler)
+        listener.start()
+        asnake_logger.addHandler(queue_handler)
+        # so a later setup_logging call replaces it
+        asnake.logging.handler = queue_handler
+
+    def close():
+        atexit.unregister(close)
+        if listener:
+            listener.stop()
+        handler.flush()
+        if stream:
+            stream.close()
+    atexit.register(close)
+    return close
+
+class RawEventWriter:
+    '''File-like object writing already rendered event lines through the active log handler, e.g. for merge_logs'''
+    def write(self, line):
+        record = logging.makeLogRecord({'name': 'asnake', 'levelno': logging.INFO, 'levelname': 'INFO',
+                                        'msg': line.rstrip('\n')})
+        asnake.logging.handler.handle(record)
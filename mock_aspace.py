@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+'''Local stand-in for the parts of the ArchivesSpace API used by these scripts.
+
+Records live in memory; archival objects are created on first request for any id.  Latency and
+server errors can be injected to approximate a loaded production server.  Run standalone, or
+start in-process via MockASpace(...).start() as benchmark.py does.'''
+
+import json
+import random
+import re
+import threading
+
+from argparse import ArgumentParser
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import sleep
+from urllib.parse import urlsplit, parse_qs
+
+routes = []
+def route(method, pattern):
+    '''Register handler for method and path regex'''
+    def decorator(fn):
+        routes.append((method, re.compile(pattern + '$'), fn))
+        return fn
+    return decorator
+
+def id_set(params):
+    '''ids from id_set[] params, or a comma-separated id_set param'''
+    ids = params.get('id_set[]', []) + params.get('id_set', [])
+    return [int(i) for value in ids for i in value.split(',') if i]
+
+class MockASpace:
+    '''In-memory ArchivesSpace, served on a background thread'''
+    def __init__(self, host='localhost', port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None,
+                 locations=100, container_profiles=20):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.top_containers = {}
+        self.archival_objects = {}
+        self.barcodes = {}
+        self.locations = list(range(1, locations + 1))
+        self.container_profiles = list(range(1, container_profiles + 1))
+        self.next_id = 1
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                mock.handle(self, 'GET')
+
+            def do_POST(self):
+                mock.handle(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def baseurl(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, method):
+        url = urlsplit(handler.path)
+        params = parse_qs(url.query)
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+
+        for route_method, pattern, fn in routes:
+            m = route_method == method and pattern.match(url.path)
+            if m:
+                break
+        else:
+            return self.respond(handler, 404, {'error': f'No route for {method} {url.path}'})
+
+        with self.lock:
+            self.requests[f'{method} {pattern.pattern[:-1]}'] += 1
+            # Login happens before scripts can configure retries, so is never failed
+            fail = fn not in {login, version} and self.random.random() < self.error_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            sleep(delay)
+        if fail:
+            return self.respond(handler, 500, {'error': 'Injected server error'})
+
+        if body and handler.headers.get('Content-Type', '').startswith('application/json'):
+            body = json.loads(body)
+        with self.lock:
+            status, payload = fn(self, params, body, *m.groups())
+        self.respond(handler, status, payload)
+
+    def respond(self, handler, status, payload):
+        data = payload.encode('utf8') if isinstance(payload, str) else json.dumps(payload).encode('utf8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def archival_object(self, repo_id, ao_id):
+        uri = f'/repositories/{repo_id}/archival_objects/{ao_id}'
+        if uri not in self.archival_objects:
+            self.archival_objects[uri] = {'jsonmodel_type': 'archival_object', 'uri': uri, 'lock_version': 0,
+                                          'title': f'Archival Object {ao_id}', 'position': 0, 'instances': []}
+        return self.archival_objects[uri]
+
+    def save_top_container(self, repo_id, container, uri=None):
+        '''Validate and store top container JSON, returns (status, response)'''
+        errors = {field: ['Property is required but was missing'] for field in ('type', 'indicator') if not container.get(field)}
+        barcode = container.get('barcode')
+        if barcode and self.barcodes.get((repo_id, barcode), uri) != uri:
+            errors['barcode'] = ['A barcode must be unique within a repository']
+        if errors:
+            return 400, {'error': errors}
+
+        if uri:
+            existing = self.top_containers[uri]
+            if container.get('lock_version') != existing['lock_version']:
+                return 409, {'error': 'The record you tried to update has been modified since you fetched it.'}
+            self.barcodes.pop((repo_id, existing.get('barcode')), None)
+            status = 'Updated'
+            tc_id = int(uri.split('/')[-1])
+            lock_version = existing['lock_version'] + 1
+        else:
+            status = 'Created'
+            tc_id = self.new_id()
+            uri = f'/repositories/{repo_id}/top_containers/{tc_id}'
+            lock_version = 0
+        self.top_containers[uri] = dict(container, uri=uri, lock_version=lock_version)
+        if barcode:
+            self.barcodes[(repo_id, barcode)] = uri
+        return 200, {'status': status, 'id': tc_id, 'lock_version': lock_version, 'uri': uri, 'warnings': []}
+
+@route('POST', r'/users/([^/]+)/login')
+def login(mock, params, body, username):
+    return 200, {'session': 'mock-session'}
+
+@route('GET', r'/version')
+def version(mock, params, body):
+    return 200, 'ArchivesSpace (v3.0.0-mock)'
+
+@route('GET', r'/(locations|container_profiles)')
+def list_refs(mock, params, body, ref_type):
+    ids = getattr(mock, ref_type)
+    if 'all_ids' in params:
+        return 200, ids
+    return 200, [{'uri': f'/{ref_type}/{i}'} for i in ids]
+
+@route('GET', r'/repositories/(\d+)')
+def get_repository(mock, params, body, repo_id):
+    return 200, {'jsonmodel_type': 'repository', 'uri': f'/repositories/{repo_id}', 'repo_code': f'MOCK{repo_id}'}
+
+@route('POST', r'/repositories/(\d+)/top_containers')
+def create_top_container(mock, params, body, repo_id):
+    return mock.save_top_container(int(repo_id), body)
+
+@route('POST', r'/repositories/(\d+)/top_containers/(\d+)')
+def update_top_container(mock, params, body, repo_id, tc_id):
+    uri = f'/repositories/{repo_id}/top_containers/{tc_id}'
+    if uri not in mock.top_containers:
+        return 404, {'error': 'Record not found'}
+    return mock.save_top_container(int(repo_id), body, uri)
+
+@route('GET', r'/repositories/(\d+)/top_containers/(\d+)')
+def get_top_container(mock, params, body, repo_id, tc_id):
+    uri = f'/repositories/{repo_id}/top_containers/{tc_id}'
+    if uri not in mock.top_containers:
+        return 404, {'error': 'Record not found'}
+    return 200, mock.top_containers[uri]
+
+@route('GET', r'/repositories/(\d+)/top_containers')
+def list_top_containers(mock, params, body, repo_id):
+    prefix = f'/repositories/{repo_id}/top_containers/'
+    if 'all_ids' in params:
+        return 200, [int(uri.split('/')[-1]) for uri in mock.top_containers if uri.startswith(prefix)]
+    ids = id_set(params)
+    if ids:
+        return 200, [mock.top_containers[prefix + str(i)] for i in ids if prefix + str(i) in mock.top_containers]
+    page, page_size = int(params.get('page', ['1'])[0]), int(params.get('page_size', ['10'])[0])
+    records = [tc for uri, tc in mock.top_containers.items() if uri.startswith(prefix)]
+    last_page = max(1, -(-len(records) // page_size))
+    return 200, {'first_page': 1, 'last_page': last_page, 'this_page': page, 'total': len(records),
+                 'results': records[(page - 1) * page_size:page * page_size]}
+
+@route('POST', r'/repositories/(\d+)/batch_imports')
+def batch_import(mock, params, body, repo_id):
+    saved, created = {}, []
+    for record in body:
+        status, result = mock.save_top_container(int(repo_id), {k:v for k,v in record.items() if k != 'uri'})
+        if status != 200:
+            # batch imports are all-or-nothing
+            for uri in created:
+                tc = mock.top_containers.pop(uri)
+                mock.barcodes.pop((int(repo_id), tc.get('barcode')), None)
+            return 200, json.dumps([{'status': [{'type': 'started', 'label': 'Saving records'}]},
+                                    {'errors': [f"{record['uri']}: {result['error']}"]}])
+        created.append(result['uri'])
+        saved[record['uri']] = [result['uri'], result['id']]
+    return 200, json.dumps([{'status': [{'type': 'started', 'label': 'Saving records'}]},
+                            {'saved': saved}])
+
+@route('GET', r'/repositories/(\d+)/archival_objects')
+def list_archival_objects(mock, params, body, repo_id):
+    return 200, [mock.archival_object(repo_id, ao_id) for ao_id in id_set(params)]
+
+@route('GET', r'/repositories/(\d+)/archival_objects/(\d+)')
+def get_archival_object(mock, params, body, repo_id, ao_id):
+    return 200, mock.archival_object(repo_id, ao_id)
+
+@route('POST', r'/repositories/(\d+)/archival_objects/(\d+)')
+def update_archival_object(mock, params, body, repo_id, ao_id):
+    existing = mock.archival_object(repo_id, ao_id)
+    if body.get('lock_version') != existing['lock_version']:
+        return 409, {'error': 'The record you tried to update has been modified since you fetched it.'}
+    for instance in body.get('instances', []):
+        ref = instance.get('sub_container', {}).get('top_container', {}).get('ref')
+        if ref and ref not in mock.top_containers:
+            return 400, {'error': {'instances/sub_container/top_container': [f'Reference {ref} does not exist']}}
+    lock_version = existing['lock_version'] + 1
+    mock.archival_objects[existing['uri']] = dict(body, uri=existing['uri'], lock_version=lock_version, position=0)
+    return 200, {'status': 'Updated', 'id': int(ao_id), 'lock_version': lock_version, 'uri': existing['uri'], 'warnings': []}
+
+ap = ArgumentParser(description='Run a local mock ArchivesSpace API')
+ap.add_argument('--port',
+                type=int,
+                default=4567,
+                help='Port to listen on')
+ap.add_argument('--latency',
+                type=float,
+                default=0.0,
+                help='Seconds of delay added to every request')
+ap.add_argument('--jitter',
+                type=float,
+                default=0.0,
+                help='Maximum random seconds of delay added on top of latency')
+ap.add_argument('--error_rate',
+                type=float,
+                default=0.0,
+                help='Fraction of requests that fail with a 500')
+
+if __name__ == '__main__':
+    args = ap.parse_args()
+    mock = MockASpace(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    print(f'Mock ArchivesSpace listening on {mock.baseurl}')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,49 @@
+'''Shared read-modify-write step for scripts that update existing records.
+
+update_record applies a change to a fetched record and posts it only if the change did something, so
+re-running a partially applied sheet rewrites only what is still wrong.  If the record was modified
+since it was fetched (a 409 on its lock_version), it is re-fetched and the change re-applied.
+
+Given a snapshots.SnapshotStore, the record as fetched is kept for rollback before it is posted, and
+the posted record is stored as its new snapshot.'''
+
+import copy
+import json
+
+from asnake.logging import get_logger
+
+# Fields of fetched records that are never posted back; an archival object's position would move it in its tree
+unposted_keys = ('position',)
+
+def fingerprint(record):
+    '''Canonical serialization of record as it would be posted'''
+    return json.dumps({k:v for k,v in record.items() if k not in unposted_keys}, sort_keys=True, default=str)
+
+def update_record(client, record, apply, conflict_retries=3, snapshots=None):
+    '''Run apply(record), which modifies record in place, and post the result if it changed.
+
+Returns (response, result) where result is what the last call to apply returned,
+and response is None if the write was skipped because nothing changed.'''
+    for attempt in range(conflict_retries + 1):
+        before = fingerprint(record)
+        original = copy.deepcopy(record) if snapshots else None
+        result = apply(record)
+        if fingerprint(record) == before:
+            return None, result
+        for key in unposted_keys:
+            record.pop(key, None)
+
+        if snapshots:
+            # After a conflict, the re-fetched record is what this post overwrites
+            snapshots.keep_before(original, replace=attempt > 0)
+        res = client.post(record['uri'], json=record)
+        if res.status_code == 200 and snapshots:
+            snapshots.put([dict(record, lock_version=res.json().get('lock_version', record['lock_version'] + 1))])
+        if res.status_code != 409 or attempt == conflict_retries:
+            return res, result
+        get_logger('record_updates').warning('retry_conflict', uri=record['uri'], attempt=attempt + 1)
+        fresh = client.get(record['uri'])
+        if fresh.status_code != 200:
+            return res, result
+        record.clear()
+        record.update(fresh.json())
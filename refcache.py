@@ -0,0 +1,87 @@
+'''Local caches of ASpace reference data, so bad refs can be caught without a round trip.'''
+
+import json
+
+from os.path import expanduser, exists
+from time import time
+
+class ReferenceCache:
+    '''Ids of all locations and container profiles, fetched once at startup.
+
+If cache_file is given, ids are saved there and reused by later runs until ttl seconds have passed.
+If db (an AspaceDB) is given, ids are read from the database instead of the API.'''
+    types = ('locations', 'container_profiles')
+
+    def __init__(self, client, cache_file=None, ttl=24 * 60 * 60, db=None):
+        self.client = client
+        self.db = db
+        self.cache_file = expanduser(cache_file) if cache_file else None
+        self.ttl = ttl
+        self.ids = None
+
+    def load(self):
+        if self.cache_file and exists(self.cache_file):
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+            if cached.get('baseurl') == self.client.config['baseurl'] and time() - cached['fetched_at'] < self.ttl:
+                self.ids = {t: set(cached[t]) for t in self.types}
+                return self
+
+        self.ids = {t: set(self.fetch_ids(t)) for t in self.types}
+        if self.cache_file:
+            with open(self.cache_file, 'w') as f:
+                json.dump(dict({t: sorted(ids) for t, ids in self.ids.items()},
+                               baseurl=self.client.config['baseurl'], fetched_at=time()), f)
+        return self
+
+    def fetch_ids(self, ref_type):
+        if self.db:
+            return self.db.all_ids(ref_type[:-1])
+        res = self.client.get(ref_type, params={'all_ids': True})
+        if res.status_code != 200:
+            raise RuntimeError(f"Could not fetch ids for {ref_type}: {res.status_code}")
+        return res.json()
+
+    def exists(self, ref_type, ref_id):
+        '''Whether a record of ref_type ('locations' or 'container_profiles') with ref_id exists'''
+        return int(ref_id) in self.ids[ref_type]
+
+class BarcodeIndex:
+    '''Mapping of barcode -> top container uri for every top container in a repository.
+
+Built with one paged bulk fetch, so existing barcodes can be found with local lookups.'''
+    def __init__(self, client, repo_id, page_size=250):
+        self.client = client
+        self.repo_id = repo_id
+        self.page_size = page_size
+        self.uris = {}
+
+    def load(self, db=None):
+        '''Fetch barcodes from the API, or from db (an AspaceDB) if given'''
+        if db:
+            self.uris = {barcode: f'/repositories/{self.repo_id}/top_containers/{tc_id}'
+                         for barcode, tc_id in db.barcodes(self.repo_id).items()}
+            return self
+        for tc in self.client.get_paged(f'repositories/{self.repo_id}/top_containers', page_size=self.page_size):
+            if tc.get('barcode'):
+                self.uris[tc['barcode']] = tc['uri']
+        return self
+
+    def __contains__(self, barcode):
+        return barcode in self.uris
+
+    def __len__(self):
+        return len(self.uris)
+
+    def uri(self, barcode):
+        return self.uris.get(barcode)
+
+    def id(self, barcode):
+        uri = self.uris.get(barcode)
+        return int(uri.split('/')[-1]) if uri else None
+
+    def add(self, barcode, uri):
+        self.uris[barcode] = uri
+
+    def discard(self, barcode):
+        self.uris.pop(barcode, None)
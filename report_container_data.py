@@ -1,69 +1,224 @@
 #!/usr/bin/env python3
 
+import csv
 import json
-from argparse import ArgumentParser, FileType
-from os.path import expanduser
-from collections import Counter
+import sys
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
 from datetime import datetime
+from time import sleep, monotonic
+
+
+from eventlog import open_log, read_lines, resolve_payloads
 
 ap = ArgumentParser(description="Report on success/failure of import process")
 ap.add_argument('logfile',
-                type=FileType('r', encoding="utf8"),
-                help="log file to process")
+                nargs='+',
+                help="log file(s) to process, in order, e.g. an import and its resumed runs (may be gzipped)")
+ap.add_argument('--format',
+                choices=['text', 'json', 'csv'],
+                default='text',
+                help="output format")
+ap.add_argument('--follow',
+                action='store_true',
+                help="keep reading the last logfile as it grows, printing running totals, until the import ends")
+ap.add_argument('--interval',
+                type=float,
+                default=10,
+                help="seconds between running totals in --follow mode")
 
+def field_issues(e):
+    return ", and ".join((f"{k.replace('_', ' ')}: {v}" for k,v in e.items() if k.endswith('fields')))
 
-if __name__ == '__main__':
-    args = ap.parse_args()
-    with args.logfile as f:
-        events = [json.loads(x) for x in f]
-        
-        end_event = events[-1]
-        if end_event['event'] != 'end_ingest':
+# (event, heading, fields kept per failure, formatter for text output)
+failure_categories = [
+    ('FAILED validate_container_row',
+     "Containers that failed validation",
+     lambda e: dict({k:v for k,v in e.items() if k.endswith('fields')}, temp_id=e.get('temp_id')),
+     lambda d: f"\ttemp_id={d['temp_id']} had {field_issues(d)}"),
+    ('FAILED create_container',
+     "Containers passed validation but couldn't be created",
+     lambda e: {'temp_id': e.get('temp_id'), 'result': e.get('result')},
+     lambda d: f"\ttemp_id={d['temp_id']} failed with the following error: {d['result']}"),
+    ('FAILED validate_sub_container_row',
+     "Instances that failed validation",
+     lambda e: {'temp_id': e.get('temp_id'), 'ao_id': e.get('ao_id'), 'empty_fields': e.get('empty_fields')},
+     lambda d: f"\ttemp_id={d['temp_id']} and archival_object_id={d['ao_id']} had empty fields: {d['empty_fields']}"),
+    ('OMITTED validate_sub_container_row',
+     "Instances that were omitted because of failed container creation",
+     lambda e: {'ao_id': e.get('ao_id'), 'temp_id': e.get('temp_id')},
+     lambda d: f"\tao_id={d['ao_id']} temp_id={d['temp_id']} omitted"),
+    ('FAILED update_ao',
+     "Instances that failed to update for some other reason",
+     lambda e: {'ao_id': e.get('ao_id'), 'result': e.get('result')},
+     lambda d: f"\tao_id={d['ao_id']} result={d['result']}"),
+]
+category_fields = {event: fields for event, _, fields, _ in failure_categories}
+# sections followed by blank lines in text output
+spaced_categories = {'FAILED validate_container_row', 'FAILED create_container', 'FAILED validate_sub_container_row'}
+
+def percentile(ordered, pct):
+    '''Nearest-rank percentile of an already sorted list'''
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+def timestamp(e):
+    return datetime.fromisoformat(e['timestamp'][:19])
+
+class Report:
+    '''Running totals and failure details, accumulated one event at a time'''
+    def __init__(self):
+        self.counts = Counter()
+        self.failures = {event: [] for event in category_fields}
+        self.first_start = None
+        self.last_start = None
+        self.end = None
+        self.last_event = None
+        self.files = 0
+        self.logfile = None # file being read, to find stored payloads in
+        self.latencies = defaultdict(list) # endpoint -> latency_ms of each request
+        self.phases = [] # phase_end events
+
+    def add(self, e):
+        event = e['event']
+        self.counts[event] += 1
+        if event in category_fields:
+            if self.logfile:
+                resolve_payloads(e, self.logfile)
+            self.failures[event].append(category_fields[event](e))
+        elif event == 'start_ingest':
+            self.last_start = timestamp(e)
+            self.first_start = self.first_start or self.last_start
+        elif event == 'end_ingest':
+            self.end = timestamp(e)
+        elif event == 'phase_end':
+            self.phases.append({k: e.get(k) for k in ('phase', 'rows', 'seconds', 'parse_seconds', 'rows_per_sec')})
+        if 'latency_ms' in e:
+            self.latencies[event.removeprefix('FAILED ')].append(e['latency_ms'])
+        self.last_event = event
+
+    def read(self, f, logfile=None):
+        self.files += 1
+        self.logfile = logfile
+        for line in read_lines(f):
+            if line.strip():
+                self.add(json.loads(line))
+
+    @property
+    def start(self):
+        # For a single log, the last start is the run that completed; across resumed runs, report the whole span
+        return self.last_start if self.files == 1 else self.first_start
+
+    def check_complete(self):
+        if self.last_event != 'end_ingest':
             exit("Partial logfile, last event is not 'end_ingest'")
-        end_time = datetime.fromisoformat(end_event['timestamp'][:19])
-        start_time = None
-        for e in reversed(events):
-            if e['event'] == 'start_ingest':
-                start_time = datetime.fromisoformat(e['timestamp'][:19])
-                break
-        if not start_time:
+        if not self.start:
             exit("Partial logfile, missing 'start_ingest'")
 
-        print(f"Processing begun at: {start_time}, completed at {end_time}, total duration {end_time - start_time}\n")
- 
-        counts = Counter()
-        for e in events:
-            counts[e['event']] += 1
-
-        print(f"Containers Created: {counts['create_container']}")
-        print(f"AOs successfully updated: {counts['update_ao']}")
-        print("\n\n")
-
-        print(f"Containers that failed validation: {counts['FAILED validate_container_row']}")
-        for e in events:
-            if e['event'] == 'FAILED validate_container_row':
-                field_issues = ", and ".join((f"{k.replace('_', ' ')}: {v}" for k,v in e.items() if k.endswith('fields')))
-                print(f"\ttemp_id={e['temp_id']} had {field_issues}")
-        print("\n\n")
-
-        print(f"Containers passed validation but couldn't be created: {counts['FAILED create_container']}")
-        for e in events:
-            if e['event'] == 'FAILED create_container':
-                print(f"\ttemp_id={e['temp_id']} failed with the following error: {e['result']}")
-        print("\n\n")
-
-        print(f"Instances that failed validation: {counts['FAILED validate_sub_container_row']}")
-        for e in events:
-            if e['event'] == 'FAILED validate_sub_container_row':
-                print(f"\ttemp_id={e['temp_id']} and archival_object_id={e['ao_id']} had empty fields: {e['empty_fields']}")
-        print("\n\n")
-
-        print(f"Instances that were omitted because of failed container creation: {counts['OMITTED validate_sub_container_row']}")
-        for e in events:
-            if e['event'] == 'OMITTED validate_sub_container_row':
-                print(f"\tao_id={e['ao_id']} temp_id={e['temp_id']} omitted")
-
-        print(f"Instances that failed to update for some other reason: {counts['FAILED update_ao']}")
-        for e in events:
-            if e['event'] == 'FAILED update_ao':
-                print(f"\tao_id={e['ao_id']} result={e['result']}")
+    def totals_line(self):
+        failed = sum(self.counts[event] for event in category_fields)
+        return (f"containers created: {self.counts['create_container']}, AOs updated: {self.counts['update_ao']}, "
+                f"failures: {failed}")
+
+    def latency_summary(self):
+        '''Dict of endpoint -> request count and latency percentiles in ms'''
+        summary = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            summary[endpoint] = {'count': len(ordered), 'p50': percentile(ordered, 50), 'p95': percentile(ordered, 95),
+                                 'p99': percentile(ordered, 99), 'max': ordered[-1]}
+        return summary
+
+    def write_text(self, out):
+        counts = self.counts
+        print(f"Processing begun at: {self.start}, completed at {self.end}, total duration {self.end - self.start}\n", file=out)
+
+        print(f"Containers Created: {counts['create_container']}", file=out)
+        print(f"AOs successfully updated: {counts['update_ao']}", file=out)
+        print("\n\n", file=out)
+
+        for event, heading, _, formatter in failure_categories:
+            print(f"{heading}: {counts[event]}", file=out)
+            for d in self.failures[event]:
+                print(formatter(d), file=out)
+            if event in spaced_categories:
+                print("\n\n", file=out)
+
+        # Only logs written with telemetry have these
+        if self.latencies:
+            print("\n\nRequest latency (ms):", file=out)
+            for endpoint, d in self.latency_summary().items():
+                print(f"\t{endpoint}: count={d['count']} p50={d['p50']} p95={d['p95']} p99={d['p99']} max={d['max']}", file=out)
+        if self.phases:
+            print("\n\nPhases:", file=out)
+            for d in self.phases:
+                print(f"\t{d['phase']}: {d['rows']} rows in {d['seconds']}s ({d['rows_per_sec']} rows/sec), "
+                      f"{d['parse_seconds']}s reading rows", file=out)
+
+    def write_json(self, out):
+        json.dump({'start': self.start.isoformat(), 'end': self.end.isoformat(),
+                   'duration_seconds': (self.end - self.start).total_seconds(),
+                   'counts': dict(self.counts),
+                   'failures': self.failures,
+                   'latency_ms': self.latency_summary(),
+                   'phases': self.phases}, out, indent=2, default=str)
+        out.write('\n')
+
+    def write_csv(self, out):
+        writer = csv.writer(out)
+        writer.writerow(['event', 'count', 'temp_id', 'ao_id', 'detail'])
+        for event, count in sorted(self.counts.items()):
+            writer.writerow([event, count, '', '', ''])
+        for event, details in self.failures.items():
+            for d in details:
+                detail = {k:v for k,v in d.items() if k not in {'temp_id', 'ao_id'}}
+                writer.writerow([event, '', d.get('temp_id', ''), d.get('ao_id', ''), json.dumps(detail, default=str)])
+        for endpoint, d in self.latency_summary().items():
+            writer.writerow([f'latency {endpoint}', d['count'], '', '', json.dumps(d)])
+        for d in self.phases:
+            writer.writerow([f"phase {d['phase']}", d['rows'], '', '', json.dumps(d)])
+
+def follow(report, f, interval, logfile=None):
+    '''Read f as it grows, printing running totals every interval seconds, until end_ingest'''
+    report.files += 1
+    report.logfile = logfile
+    partial = ''
+    last_print = monotonic()
+    while True:
+        try:
+            line = f.readline()
+        except f.truncated_errors:
+            # A compressed log still being written ends mid-member; try again once more has been written
+            line = ''
+        if line:
+            partial += line
+            if partial.endswith('\n'):
+                if partial.strip():
+                    report.add(json.loads(partial))
+                partial = ''
+                if report.last_event == 'end_ingest':
+                    break
+        else:
+            sleep(0.5)
+        if monotonic() - last_print >= interval:
+            print(report.totals_line(), file=sys.stderr, flush=True)
+            last_print = monotonic()
+
+if __name__ == '__main__':
+    args = ap.parse_args()
+    report = Report()
+
+    for filename in args.logfile[:-1]:
+        with open_log(filename) as f:
+            report.read(f, filename)
+    with open_log(args.logfile[-1]) as f:
+        if args.follow:
+            try:
+                follow(report, f, args.interval, args.logfile[-1])
+            except KeyboardInterrupt:
+                print(report.totals_line(), file=sys.stderr)
+                exit(1)
+        else:
+            report.read(f, args.logfile[-1])
+
+    report.check_complete()
+    {'text': report.write_text, 'json': report.write_json, 'csv': report.write_csv}[args.format](sys.stdout)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+'''Persistent snapshots of fetched and posted records, keyed by URI and lock_version.
+
+A SQLite file of compressed record JSON, filled from every archival object fetch and every successful post
+by scripts given --snapshots.  A snapshot is only used while its lock_version matches the one in the database
+(--db), which is checked for a whole chunk of archival objects with one query, so unchanged records aren't
+downloaded again by a later run or script.
+
+Before a record is first posted by a run, its previous JSON is kept under the run's logfile name, so that
+`snapshots.py --rollback LOGFILE` can put back every record a bad run changed.'''
+
+import json
+import sqlite3
+import threading
+import zlib
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from more_itertools import chunked
+from os.path import expanduser
+
+schema = '''
+CREATE TABLE IF NOT EXISTS snapshots (uri TEXT PRIMARY KEY, lock_version INTEGER NOT NULL, json BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS before_update (run TEXT NOT NULL, uri TEXT NOT NULL, lock_version INTEGER NOT NULL,
+                                          json BLOB NOT NULL, PRIMARY KEY (run, uri));
+'''
+
+def add_snapshot_arguments(ap):
+    '''Add CLI options for a snapshot store to an ArgumentParser'''
+    ap.add_argument('--snapshots',
+                    default=None,
+                    help='Filename of SQLite snapshot store, created if missing, to reuse unchanged archival objects from (with --db) and roll back from')
+
+def compress(record):
+    return zlib.compress(json.dumps(record, separators=(',', ':'), default=str).encode('utf8'))
+
+def decompress(data):
+    return json.loads(zlib.decompress(data))
+
+def id_from_uri(uri):
+    return int(uri.split('/')[-1])
+
+class SnapshotStore:
+    '''SQLite store of record snapshots, shared between the threads of a run.
+
+run names the run posting records, for rollback'''
+    def __init__(self, filename, run=None):
+        self.conn = sqlite3.connect(expanduser(filename), timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(schema)
+        self.run = run
+        self.lock = threading.Lock()
+
+    def put(self, records):
+        '''Store the current JSON of records, each with its uri and lock_version'''
+        rows = [(record['uri'], record['lock_version'], compress(record)) for record in records]
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO snapshots (uri, lock_version, json) VALUES (?, ?, ?)', rows)
+
+    def get(self, versions):
+        '''Snapshots for a mapping of uri -> current lock_version, as uri -> JSON, for those stored at that version'''
+        snapshots = {}
+        with self.lock:
+            for chunk in chunked(versions, 500):
+                placeholders = ', '.join('?' * len(chunk))
+                for uri, lock_version, data in self.conn.execute(
+                        f'SELECT uri, lock_version, json FROM snapshots WHERE uri IN ({placeholders})', chunk):
+                    if versions[uri] == lock_version:
+                        snapshots[uri] = decompress(data)
+        return snapshots
+
+    def keep_before(self, record, replace=False):
+        '''Keep record, as fetched, as its state before this run first posted it, unless replace is set'''
+        with self.lock, self.conn:
+            self.conn.execute(f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO before_update (run, uri, lock_version, json) "
+                              'VALUES (?, ?, ?, ?)',
+                              (self.run, record['uri'], record['lock_version'], compress(record)))
+
+    def before(self, run):
+        '''Yield each (uri, JSON) kept before run posted it'''
+        with self.lock:
+            rows = self.conn.execute('SELECT uri, json FROM before_update WHERE run = ? ORDER BY uri', (run,)).fetchall()
+        for uri, data in rows:
+            yield uri, decompress(data)
+
+    def runs(self):
+        '''List of (run, number of records it posted)'''
+        with self.lock:
+            return self.conn.execute('SELECT run, count(*) FROM before_update GROUP BY run ORDER BY run').fetchall()
+
+    def close(self):
+        self.conn.close()
+
+def fetch_archival_objects(client, repo_id, ao_ids, snapshots=None, db=None):
+    '''Fetch archival objects by id, taking those whose stored snapshot is still current in db from snapshots.
+
+Returns (dict of ao_id -> JSON, response or None if nothing needed fetching, number taken from snapshots).
+If the response isn't a 200, only the snapshots are returned.'''
+    current = {}
+    if snapshots and db:
+        versions = db.archival_object_versions(repo_id, ao_ids)
+        current = {id_from_uri(uri): ao for uri, ao in snapshots.get(
+            {f'/repositories/{repo_id}/archival_objects/{ao_id}': lock_version
+             for ao_id, lock_version in versions.items()}).items()}
+    missing = [ao_id for ao_id in ao_ids if ao_id not in current]
+    if not missing:
+        return current, None, len(current)
+
+    res = client.get(f'repositories/{repo_id}/archival_objects', params={'id_set': missing})
+    if res.status_code != 200:
+        return current, res, len(current)
+    fetched = res.json()
+    if snapshots:
+        snapshots.put(fetched)
+    return {**current, **{id_from_uri(ao['uri']): ao for ao in fetched}}, res, len(current)
+
+ap = ArgumentParser(description='List the runs in a snapshot store, or roll one back')
+ap.add_argument('snapshots',
+                help='Snapshot store written with --snapshots')
+ap.add_argument('--rollback',
+                default=None,
+                help='Logfile name of the run to roll back; each record it posted is restored to how it was before')
+ap.add_argument('--logfile',
+                default='rollback.log',
+                help='Filename for log output')
+ap.add_argument('--concurrency',
+                type=int,
+                default=4,
+                help='Number of records to restore in parallel')
+ap.add_argument('--chunk_size',
+                type=int,
+                default=100,
+                help='Number of records to fetch per request')
+
+def restore(record, before):
+    '''Replace record's contents with before, keeping record's current lock_version'''
+    lock_version = record['lock_version']
+    record.clear()
+    record.update(before, lock_version=lock_version)
+
+if __name__ == '__main__':
+    from asnake.aspace import ASpace
+    from asnake.logging import get_logger
+
+    from aspace_session import add_client_arguments, configure_client
+    from logsink import add_log_arguments, setup_event_log
+    from record_updates import update_record
+    from workers import WorkerPool
+
+    add_client_arguments(ap)
+    add_log_arguments(ap)
+    args = ap.parse_args()
+
+    if not args.rollback:
+        store = SnapshotStore(args.snapshots)
+        for run, count in store.runs():
+            print(f"{run}: {count} records")
+        exit(0)
+
+    setup_event_log(args.logfile, args)
+    log = get_logger('snapshots')
+    # The rollback keeps what it overwrites too, so it can itself be rolled back
+    store = SnapshotStore(args.snapshots, run=args.logfile)
+    aspace = ASpace()
+    configure_client(aspace.client, args, args.concurrency + 1)
+
+    # uri prefix (e.g. /repositories/2/archival_objects) -> [(id, JSON before)]
+    by_prefix = defaultdict(list)
+    for uri, before in store.before(args.rollback):
+        prefix, _, record_id = uri.rpartition('/')
+        by_prefix[prefix].append((int(record_id), before))
+
+    def restore_record(record, before):
+        '''Post record back to how it was, if it isn't already, runs on worker threads'''
+        res, _ = update_record(aspace.client, record, lambda record: restore(record, before), snapshots=store)
+        return record['uri'], res
+
+    def record_result(result):
+        uri, res = result
+        if res is None:
+            log.info('skip_noop', uri=uri)
+        elif res.status_code == 200:
+            log.info('rollback', uri=uri)
+        else:
+            log.error('FAILED rollback', uri=uri, status=res.status_code, result=res.text)
+
+    log.info('start_rollback', run=args.rollback)
+    with WorkerPool(args.concurrency) as pool:
+        for prefix, records in by_prefix.items():
+            for chunk in chunked(records, args.chunk_size):
+                res = aspace.client.get(prefix.lstrip('/'), params={'id_set': [record_id for record_id, _ in chunk]})
+                if res.status_code != 200:
+                    raise RuntimeError(f"Something went wrong with batch of IDs: {[record_id for record_id, _ in chunk]}")
+                current = {record['uri']: record for record in res.json()}
+                for record_id, before in chunk:
+                    record = current.get(f'{prefix}/{record_id}')
+                    if record is None:
+                        log.error('FAILED rollback', uri=f'{prefix}/{record_id}', result='record not found')
+                        continue
+                    pool.submit(record_result, restore_record, record, before)
+    log.info('end_rollback', run=args.rollback)
+    store.close()
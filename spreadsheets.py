@@ -0,0 +1,94 @@
+'''Streaming spreadsheet reader shared by the import and fixup scripts.
+
+Workbooks are opened read-only and iterated values-only, so rows are produced one at a time
+in constant memory.  CSV and TSV files are read as single-sheet workbooks.'''
+
+import csv
+import datetime
+import openpyxl
+
+from os.path import expanduser, splitext
+
+class ExcelSheet:
+    '''Sheet of a read-only openpyxl workbook, iterates over tuples of cell values'''
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.title = worksheet.title
+
+    def __iter__(self):
+        return self.worksheet.iter_rows(values_only=True)
+
+    @property
+    def row_count(self):
+        '''Number of rows below the header as recorded in the sheet's dimensions, or None if unrecorded'''
+        max_row = self.worksheet.max_row
+        return max(0, max_row - 1) if max_row else None
+
+class DelimitedSheet:
+    '''CSV/TSV file treated as a sheet, iterates over tuples of cell values'''
+    def __init__(self, filename, delimiter=','):
+        self.filename = filename
+        self.delimiter = delimiter
+        self.title = filename
+        self.row_count = None
+
+    def __iter__(self):
+        with open(self.filename, newline='', encoding='utf-8-sig') as f:
+            for row in csv.reader(f, delimiter=self.delimiter):
+                yield tuple(value if value != '' else None for value in row)
+
+delimiters = {'.csv': ',', '.tsv': '\t', '.tab': '\t'}
+def open_workbook(filename):
+    '''Open a spreadsheet for streaming, returns a list of sheets.
+
+Suitable for use as an argparse type.'''
+    filename = expanduser(filename)
+    ext = splitext(filename)[1].lower()
+    if ext in delimiters:
+        return [DelimitedSheet(filename, delimiters[ext])]
+    wb = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    return [ExcelSheet(ws) for ws in wb.worksheets]
+
+def _to_integer(value):
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, str):
+        value = value.strip()
+        # CSV/TSV cells, and some xlsx ones, hold whole numbers as e.g. "12.0"
+        if '.' in value:
+            value = float(value)
+    return int(value) if value else ''
+
+def _to_string(value):
+    if value is None:
+        return ''
+    elif isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    else:
+        return str(value).strip()
+
+def _to_unstripped_string(value):
+    if value is None:
+        return ''
+    elif isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    else:
+        return str(value)
+
+def dictify_sheet(sheet, enforce_integer=frozenset(), strip=True, skip_blank=True):
+    '''Yield each row of a sheet as a dict keyed by the header row.
+
+Converters are chosen once per column from the header: columns in enforce_integer become ints
+(or '' when empty), dates become ISO date strings, and everything else becomes a string.'''
+    rows = iter(sheet)
+    to_string = _to_string if strip else _to_unstripped_string
+    headers = [(idx, str(value).strip()) for idx, value in enumerate(next(rows)) if value]
+    columns = [(idx, header, _to_integer if header in enforce_integer else to_string)
+               for idx, header in headers]
+
+    for row in rows:
+        width = len(row)
+        out = {header: convert(row[idx] if idx < width else None) for idx, header, convert in columns}
+        if skip_blank and not any(out.values()): # skip blank rows
+            continue
+        yield out
@@ -0,0 +1,137 @@
+'''Timing instrumentation for the import and fixup scripts.
+
+Records per-request latency and payload sizes (returned as fields to log alongside each API event),
+emits periodic `progress` events with rows/sec and ETA, and optionally keeps a Prometheus textfile of
+running totals up to date.'''
+
+import os
+import threading
+
+from collections import defaultdict
+from time import monotonic
+
+def add_telemetry_arguments(ap):
+    '''Add CLI options controlling progress reporting to an ArgumentParser'''
+    ap.add_argument('--progress_interval',
+                    type=float,
+                    default=30,
+                    help='Seconds between progress events in the log')
+    ap.add_argument('--stats_file',
+                    default=None,
+                    help='Prometheus textfile to keep updated with request and progress statistics')
+
+def response_seconds(res):
+    '''Seconds taken by a response, including any retries'''
+    return getattr(res, 'total_elapsed', None) or res.elapsed.total_seconds()
+
+class Telemetry:
+    '''Request statistics and phase progress for one script run'''
+    def __init__(self, log, interval=30, stats_file=None, job='aspace_container_mgmt'):
+        self.log = log
+        self.interval = interval
+        self.stats_file = stats_file
+        self.job = job
+        self.lock = threading.Lock()
+        self.requests = defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'request_bytes': 0, 'response_bytes': 0})
+        self.phase_name = None
+        self.last_emit = monotonic()
+
+    def record(self, endpoint, res):
+        '''Record a response under endpoint, returning fields to log with its event'''
+        seconds = response_seconds(res)
+        body = res.request.body if res.request is not None else None
+        stats = {'latency_ms': round(seconds * 1000, 1),
+                 'request_bytes': len(body or b''),
+                 'response_bytes': len(res.content or b'')}
+        with self.lock:
+            totals = self.requests[endpoint]
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['request_bytes'] += stats['request_bytes']
+            totals['response_bytes'] += stats['response_bytes']
+        return stats
+
+    def phase(self, name, total=None):
+        '''Start timing a phase of total rows (if known), ending any current phase'''
+        if self.phase_name:
+            self.end_phase()
+        self.phase_name = name
+        self.phase_total = total
+        self.phase_done = 0
+        self.phase_start = monotonic()
+        self.parse_seconds = 0.0
+        self.log.info('phase_start', phase=name, total=total)
+
+    def advance(self, n=1):
+        '''Count n rows of the current phase as done, emitting progress if due'''
+        self.phase_done += n
+        if monotonic() - self.last_emit >= self.interval:
+            self.emit_progress()
+
+    def timed_rows(self, rows):
+        '''Wrap an iterable of rows, adding time spent producing them to the phase's parse time'''
+        rows = iter(rows)
+        while True:
+            start = monotonic()
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.parse_seconds += monotonic() - start
+                return
+            self.parse_seconds += monotonic() - start
+            yield row
+
+    def progress(self):
+        elapsed = monotonic() - self.phase_start
+        rate = self.phase_done / elapsed if elapsed else 0.0
+        eta = None
+        if self.phase_total and rate:
+            eta = round(max(0, self.phase_total - self.phase_done) / rate)
+        return {'phase': self.phase_name, 'done': self.phase_done, 'total': self.phase_total,
+                'elapsed_seconds': round(elapsed, 1), 'rows_per_sec': round(rate, 2), 'eta_seconds': eta}
+
+    def emit_progress(self):
+        self.last_emit = monotonic()
+        progress = self.progress()
+        self.log.info('progress', **progress)
+        if self.stats_file:
+            self.write_stats(progress)
+
+    def end_phase(self):
+        progress = self.progress()
+        self.log.info('phase_end', phase=self.phase_name, rows=self.phase_done,
+                      seconds=progress['elapsed_seconds'], parse_seconds=round(self.parse_seconds, 2),
+                      rows_per_sec=progress['rows_per_sec'])
+        if self.stats_file:
+            self.write_stats(progress)
+        self.phase_name = None
+
+    def write_stats(self, progress):
+        '''Atomically rewrite the Prometheus textfile'''
+        lines = []
+        with self.lock:
+            requests = {endpoint: dict(totals) for endpoint, totals in self.requests.items()}
+        for metric, key, help_text in [('aspace_requests_total', 'count', 'API requests made'),
+                                       ('aspace_request_seconds_total', 'seconds', 'Seconds spent in API requests'),
+                                       ('aspace_request_bytes_total', 'request_bytes', 'Bytes of API request bodies'),
+                                       ('aspace_response_bytes_total', 'response_bytes', 'Bytes of API response bodies')]:
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for endpoint, totals in sorted(requests.items()):
+                lines.append(f'{metric}{{job="{self.job}",endpoint="{endpoint}"}} {totals[key]}')
+        labels = f'job="{self.job}",phase="{progress["phase"]}"'
+        lines.append('# TYPE aspace_phase_rows_done gauge')
+        lines.append(f'aspace_phase_rows_done{{{labels}}} {progress["done"]}')
+        lines.append('# TYPE aspace_phase_rows_per_second gauge')
+        lines.append(f'aspace_phase_rows_per_second{{{labels}}} {progress["rows_per_sec"]}')
+        if progress['total'] is not None:
+            lines.append('# TYPE aspace_phase_rows_total gauge')
+            lines.append(f'aspace_phase_rows_total{{{labels}}} {progress["total"]}')
+        if progress['eta_seconds'] is not None:
+            lines.append('# TYPE aspace_phase_eta_seconds gauge')
+            lines.append(f'aspace_phase_eta_seconds{{{labels}}} {progress["eta_seconds"]}')
+
+        tmp = f'{self.stats_file}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.stats_file)
@@ -0,0 +1,82 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from itertools import islice
+
+class WorkerPool:
+    '''Bounded pool of worker threads for API calls.
+
+Work is run on the pool, but each result is handed to its callback on the calling thread,
+so bookkeeping and logging stay single-threaded and happen exactly once per submitted job.
+At most `concurrency` jobs are in flight at a time; submit blocks until a slot is free.'''
+
+    def __init__(self, concurrency=1):
+        self.concurrency = max(1, concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.pending = {}
+
+    def submit(self, callback, fn, *args, **kwargs):
+        '''Run fn(*args, **kwargs) on the pool, and callback(result) on this thread once done'''
+        while len(self.pending) >= self.concurrency:
+            self.reap()
+        self.pending[self.executor.submit(fn, *args, **kwargs)] = callback
+
+    def dispatch(self, done):
+        '''Run the callbacks of finished jobs that succeeded, returning the first error raised by any that didn't'''
+        error = None
+        for future in done:
+            callback = self.pending.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+            else:
+                callback(future.result())
+        return error
+
+    def reap(self, return_when=FIRST_COMPLETED):
+        '''Wait for in-flight jobs and dispatch their results to callbacks.
+
+If a job raised, every other job is still waited for and its callback run before the error is re-raised,
+so work that did succeed (e.g. a container that was created) is always recorded.'''
+        if not self.pending:
+            return
+        done, _ = wait(self.pending, return_when=return_when)
+        error = self.dispatch(done)
+        if error is not None:
+            self.settle()
+            raise error
+
+    def drain(self):
+        '''Wait for all in-flight jobs'''
+        self.reap(return_when=ALL_COMPLETED)
+
+    def settle(self):
+        '''Wait for all in-flight jobs and run the callbacks of those that succeeded, ignoring errors'''
+        while self.pending:
+            done, _ = wait(self.pending, return_when=ALL_COMPLETED)
+            self.dispatch(done)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.drain()
+        else:
+            self.settle()
+        self.executor.shutdown(wait=True)
+
+def prefetched(fetch, items, depth=1):
+    '''Yield (item, fetch(item)) for each item in order, fetching up to `depth` items ahead in the background.
+
+Lets the caller work on one chunk while the following chunks' GETs are already in flight.  While it waits
+for a chunk, that chunk's fetch and the `depth` after it may be in flight at once.  A depth of 0 fetches
+each item only when it's needed.'''
+    items = iter(items)
+    if depth < 1:
+        yield from ((item, fetch(item)) for item in items)
+        return
+    with ThreadPoolExecutor(max_workers=depth + 1) as executor:
+        queue = deque((item, executor.submit(fetch, item)) for item in islice(items, depth))
+        while queue:
+            item, future = queue.popleft()
+            queue.extend((item, executor.submit(fetch, item)) for item in islice(items, 1))
+            yield item, future.result()